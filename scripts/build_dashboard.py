@@ -12,13 +12,20 @@ from __future__ import annotations
 
 import json
 import re
-from dataclasses import dataclass
+from collections import defaultdict
+from dataclasses import asdict, dataclass
 from datetime import date, datetime, timezone
+from functools import cache
 from pathlib import Path
 from typing import Any
 
 import pandas as pd
 
+try:
+    import orjson
+except ImportError:  # stdlib json fallback for local runs without it
+    orjson = None
+
 ROOT_DIR = Path(__file__).resolve().parents[1]
 DAILY_CSV  = ROOT_DIR / "data/407_daily_due_list.csv"
 WEEKLY_CSV = ROOT_DIR / "data/407_Due-List_weekly.csv"
@@ -27,6 +34,29 @@ OUTPUT_JSON  = ROOT_DIR / "public/data/dashboard.json"
 
 COMPONENT_WINDOW_HOURS = 200
 
+# Only the columns the builder reads are parsed (the exports carry ~77).
+# Text columns are pinned so the parser skips type inference on them, with
+# the low-cardinality type columns as categories. Numeric columns stay
+# inferred, so exports with thousands separators or units still load.
+CSV_DTYPES = {
+    "Registration Number":  str,
+    "Airframe Report Date": str,
+    "ATA and Code":         str,
+    "Description":          str,
+    "Next Due Date":        str,
+    "Item Type":            "category",
+    "Requirement Type":     "category",
+}
+NUMERIC_COLUMNS = ("Airframe Hours", "Remaining Days", "Remaining Hours")
+# Coerced once by _read_csv with the lenient _to_float_col. Remaining Hours
+# stays raw: the component window filter needs strict pd.to_numeric.
+COERCED_COLUMNS = ("Airframe Hours", "Remaining Days")
+CSV_COLUMNS = {*CSV_DTYPES, *NUMERIC_COLUMNS}
+
+# Date formats tried in order before falling back to inference: due-list
+# exports write MM/DD/YYYY, ISO covers re-saved or hand-edited files.
+DATE_FORMATS = ("%m/%d/%Y", "%Y-%m-%d")
+
 INSPECTION_RULES = [
     ("12 Month",             "05 12MO- INSPECTION"),
     ("24 Month",             "05 24MO. INSPECTION"),
@@ -42,8 +72,11 @@ INSPECTION_RULES = [
     ("Spring Link Interim",  "67 20-12 INTERIM"),
 ]
 
+# Anything str.isalnum() rejects; ATA codes are compared on what remains.
+_NON_ALNUM = re.compile(r"[\W_]+")
+
 
-@dataclass
+@dataclass(slots=True)
 class InspectionItem:
     tail: str
     inspection: str
@@ -61,87 +94,218 @@ def _clean(value: Any) -> str:
 
 
 def _norm_ata(value: Any) -> str:
-    return "".join(ch for ch in _clean(value).upper() if ch.isalnum())
+    text = _clean(value).upper()
+    if text.isalnum():
+        return text
+    return _NON_ALNUM.sub("", text)
 
 
-def _to_date(value: Any) -> str | None:
-    if pd.isna(value):
-        return None
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    """Column by name, or an all-missing column when the export lacks it."""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(None, index=df.index, dtype=object)
+
+
+def _clean_col(series: pd.Series) -> pd.Series:
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)  # "" is not one of the categories
+    return series.fillna("").astype(str).str.strip()
+
+
+def _upper_isin(series: pd.Series, values: set[str]) -> pd.Series:
+    """Case-insensitive isin that only uppercases the distinct values."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        distinct = series.cat.categories
+    else:
+        distinct = series.dropna().unique()
+    return series.isin([v for v in distinct if str(v).upper() in values])
+
+
+# Rule targets are constants, so normalise them once at import. Spelling
+# variants in INSPECTION_RULES (e.g. "24MO." vs "24.MO.") collapse to the
+# same target and are kept only once.
+_RULE_PAIRS = list(dict.fromkeys(
+    (rule_ata, label)
+    for rule_ata, label in ((_norm_ata(ata), label) for label, ata in INSPECTION_RULES)
+    if rule_ata
+))
+
+# Every rule target in one alternation: a code that misses it cannot match
+# any individual rule, so the per-rule scans only see candidate codes.
+_RULE_PATTERN = re.compile("|".join(re.escape(rule_ata) for rule_ata, _ in _RULE_PAIRS))
+
+
+@cache
+def _ata_labels(ata: str) -> tuple[str, ...]:
+    """
+    Inspection labels whose rule target occurs in the normalised ATA code.
+    Cached: the weekly and daily exports share most of their ATA codes.
+    """
+    norm_ata = _norm_ata(ata)
+    if not _RULE_PATTERN.search(norm_ata):
+        return ()
+    return tuple(dict.fromkeys(label for rule_ata, label in _RULE_PAIRS if rule_ata in norm_ata))
+
+
+def _parse_date_value(value: Any) -> pd.Timestamp:
+    """
+    Last-resort parse of one stray value. Each value keeps its own wall-clock
+    date and drops any timezone, so a column mixing naive and offset
+    timestamps still comes out tz-naive.
+    """
     parsed = pd.to_datetime(value, errors="coerce")
     if pd.isna(parsed):
-        return None
-    return parsed.date().isoformat()
+        return pd.NaT
+    return parsed.tz_localize(None) if parsed.tzinfo is not None else parsed
 
 
-def _to_float(value: Any) -> float | None:
-    if pd.isna(value):
-        return None
-
-    if isinstance(value, str):
-        cleaned = value.strip().replace(",", "")
-        match = re.search(r"[-+]?\d*\.?\d+", cleaned)
-        if not match:
-            return None
-        cleaned = match.group(0)
-    else:
-        cleaned = value
+def _tz_naive(parsed: pd.Series) -> pd.Series:
+    """Drop any timezone, keeping wall-clock time, so every pass shares one dtype."""
+    if isinstance(parsed.dtype, pd.DatetimeTZDtype):
+        return parsed.dt.tz_localize(None)
+    return parsed
 
-    try:
-        return float(cleaned)
-    except (TypeError, ValueError):
-        return None
+
+def _parse_dates(series: pd.Series) -> pd.Series:
+    # Each pass only re-parses cells the previous formats missed, so
+    # per-element parsing is reserved for the odd stray value. Every pass is
+    # made tz-naive before it is merged, so an offset-bearing format cannot
+    # upcast the column to object.
+    parsed = _tz_naive(pd.to_datetime(series, errors="coerce", format=DATE_FORMATS[0]))
+    for fmt in DATE_FORMATS[1:]:
+        retry = parsed.isna() & series.notna()
+        if not retry.any():
+            return parsed
+        parsed[retry] = _tz_naive(pd.to_datetime(series[retry], errors="coerce", format=fmt))
+    retry = parsed.isna() & series.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(series[retry].map(_parse_date_value))
+    return parsed
+
+
+def _iso_dates(parsed: pd.Series) -> pd.Series:
+    """ISO date strings for a parsed column, None where unparseable."""
+    return parsed.dt.strftime("%Y-%m-%d").astype(object).where(parsed.notna(), None)
+
+
+def _to_date_col(series: pd.Series) -> pd.Series:
+    return _iso_dates(_parse_dates(series))
+
+
+def _to_float_col(series: pd.Series) -> pd.Series:
+    """Float column, NaN where blank; text cells use their first number."""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    number = (
+        series.astype(str)
+        .str.replace(",", "", regex=False)
+        .str.extract(r"([-+]?\d*\.?\d+)", expand=False)
+    )
+    return pd.to_numeric(number, errors="coerce").astype(float)
+
+
+def _none_for_nan(series: pd.Series) -> pd.Series:
+    return series.astype(object).where(series.notna(), None)
 
 
 def _read_csv(path: Path) -> pd.DataFrame:
     for enc in ("utf-8-sig", "cp1252"):
         try:
-            return pd.read_csv(path, encoding=enc, low_memory=False)
+            df = pd.read_csv(
+                path,
+                encoding=enc,
+                usecols=lambda col: col in CSV_COLUMNS,
+                dtype=CSV_DTYPES,
+                low_memory=False,
+            )
         except UnicodeDecodeError:
             continue
+        for col in COERCED_COLUMNS:
+            if col in df.columns:
+                df[col] = _to_float_col(df[col])
+        return df
     raise ValueError(f"Unable to decode {path}")
 
 
+def _read_json(path: Path) -> Any:
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _write_json(path: Path, payload: Any) -> None:
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+    else:
+        path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+
+
 def _load_history() -> dict[str, dict[str, float]]:
     if not HISTORY_JSON.exists():
         return {}
     try:
-        return json.loads(HISTORY_JSON.read_text(encoding="utf-8"))
-    except json.JSONDecodeError:
+        return _read_json(HISTORY_JSON)
+    except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses it
         return {}
 
 
 def _save_history(history: dict[str, dict[str, float]]) -> None:
-    HISTORY_JSON.write_text(json.dumps(history, indent=2), encoding="utf-8")
+    _write_json(HISTORY_JSON, history)
 
 
 def _update_history(
-    history: dict[str, dict[str, float]], frame: pd.DataFrame
-) -> dict[str, dict[str, float]]:
-    """Add the latest daily CSV flight-hour readings into persisted history."""
+    history: dict[str, dict[str, float]], *frames: pd.DataFrame
+) -> tuple[dict[str, dict[str, float]], int]:
+    """
+    Add CSV flight-hour readings into persisted history.
+    Frames are applied in order, so later frames win for the same report date.
+    Returns the history and how many readings differ from the loaded history.
+    """
     cols = ["Registration Number", "Airframe Report Date", "Airframe Hours"]
-    missing = [c for c in cols if c not in frame.columns]
-    if missing:
-        return history
-
-    for _, row in frame[cols].drop_duplicates().iterrows():
-        tail = _clean(row["Registration Number"])
-        dt = _to_date(row["Airframe Report Date"])
-        hours = _to_float(row["Airframe Hours"])
-        if not tail or not dt or hours is None:
-            continue
-        history.setdefault(tail, {})
+    # reindex() turns a frame missing any of the columns into blank readings,
+    # which the validity mask below drops.
+    frame = pd.concat([f.reindex(columns=cols) for f in frames], ignore_index=True)
+
+    # Every item row repeats its aircraft's reading, so dedupe the raw rows
+    # before cleaning; keep="last" leaves the last occurrence of each row in
+    # place, so a later frame still outranks an earlier one.
+    raw = frame[cols].drop_duplicates(keep="last")
+    readings = pd.DataFrame(
+        {
+            "tail":    _clean_col(raw["Registration Number"]),
+            "date":    _to_date_col(raw["Airframe Report Date"]),
+            "reading": _to_float_col(raw["Airframe Hours"]),
+        }
+    )
+    readings = readings[
+        (readings["tail"] != "") & readings["date"].notna() & readings["reading"].notna()
+    ]
+    # One reading per (tail, report date): the last one seen wins.
+    readings = readings.drop_duplicates(["tail", "date"], keep="last")
+
+    # Copy each tail's points so the loaded history stays the baseline to diff against.
+    updated: defaultdict[str, dict[str, float]] = defaultdict(
+        dict, {tail: dict(points) for tail, points in history.items()}
+    )
+    changed = 0
+    for tail, dt, reading in zip(readings["tail"], readings["date"], readings["reading"]):
         # Always accept the latest reading for the report date in case corrections are made.
-        history[tail][dt] = hours
-    return history
+        updated[tail][dt] = reading
+        if history.get(tail, {}).get(dt) != reading:
+            changed += 1
+    return dict(updated), changed
 
 
 def _hour_deltas(points: list[tuple[str, float]]) -> list[dict[str, float | str | int]]:
     """Build per-update flight-hour deltas from ordered (date, hours) points."""
     deltas: list[dict[str, float | str | int]] = []
+    # Each date is the "curr" of one step and the "prev" of the next; parse once.
+    parsed = [date.fromisoformat(dt) for dt, _ in points]
     for idx in range(1, len(points)):
         prev_date, prev_hours = points[idx - 1]
         curr_date, curr_hours = points[idx]
-        days_between = max((date.fromisoformat(curr_date) - date.fromisoformat(prev_date)).days, 1)
+        days_between = max((parsed[idx] - parsed[idx - 1]).days, 1)
         hours_delta = curr_hours - prev_hours
         deltas.append(
             {
@@ -155,80 +319,82 @@ def _hour_deltas(points: list[tuple[str, float]]) -> list[dict[str, float | str
     return deltas
 
 
+def _empty_utilization() -> dict[str, Any]:
+    return {"avg_daily_hours": None, "avg_weekly_hours": None, "daily_points": [], "hour_deltas": []}
+
+
 def _utilization(history: dict[str, dict[str, float]]) -> dict[str, Any]:
     stats: dict[str, Any] = {}
     for tail, points in history.items():
-        ordered = sorted(points.items(), key=lambda x: x[0])
-        deltas = _hour_deltas(ordered)
-        if not deltas:
-            stats[tail] = {
-                "avg_daily_hours": None,
-                "avg_weekly_hours": None,
-                "daily_points": [],
-                "hour_deltas": [],
-            }
+        # Dates are unique ISO keys, so plain tuple order sorts by date.
+        ordered = sorted(points.items())
+        if len(ordered) < 2:
+            stats[tail] = _empty_utilization()
             continue
 
-        total_hours = sum(float(item["hours_delta"]) for item in deltas)
-        total_days = sum(int(item["days_between"]) for item in deltas)
-        avg_daily = total_hours / total_days if total_days else 0.0
+        # Summed deltas telescope to the first-to-last span, so only the
+        # deltas the page shows are built.
+        (first_date, first_hours), (last_date, last_hours) = ordered[0], ordered[-1]
+        total_days = (date.fromisoformat(last_date) - date.fromisoformat(first_date)).days
+        avg_daily = (last_hours - first_hours) / total_days if total_days else 0.0
 
         days = [{"date": dt, "hours": hrs} for dt, hrs in ordered[-30:]]
         stats[tail] = {
             "avg_daily_hours":  round(avg_daily, 3),
             "avg_weekly_hours": round(avg_daily * 7, 3),
             "daily_points":     days,
-            "hour_deltas":      deltas[-30:],
+            "hour_deltas":      _hour_deltas(ordered[-31:]),
         }
     return stats
 
 
-def _collect_inspections(df: pd.DataFrame) -> list[InspectionItem]:
+def _collect_inspections(df: pd.DataFrame, today: date) -> list[InspectionItem]:
     """
     Parse inspection items from a dataframe.
     Filters to Item Type == INSPECTION.
     Uses substring match on normalised ATA code.
     """
-    inspections: list[InspectionItem] = []
-
     if "Item Type" in df.columns:
-        insp_df = df[df["Item Type"].astype(str).str.upper() == "INSPECTION"]
+        insp_df = df[_upper_isin(df["Item Type"], {"INSPECTION"})]
     else:
         insp_df = df
 
-    rule_pairs = [(_norm_ata(ata), label) for label, ata in INSPECTION_RULES]
-
-    for _, row in insp_df.iterrows():
-        raw_ata  = _clean(row.get("ATA and Code", ""))
-        norm_ata = _norm_ata(raw_ata)
-
-        matched_labels: list[str] = []
-        for rule_ata, label in rule_pairs:
-            if rule_ata and rule_ata in norm_ata:
-                if label not in matched_labels:
-                    matched_labels.append(label)
-
-        if not matched_labels:
-            continue
-
-        tail           = _clean(row.get("Registration Number", ""))
-        due_date       = _to_date(row.get("Next Due Date"))
-        remaining_days = _to_float(row.get("Remaining Days"))
-        if due_date:
-            remaining_days = float((date.fromisoformat(due_date) - date.today()).days)
-
-        for label in matched_labels:
-            inspections.append(
-                InspectionItem(
-                    tail=tail,
-                    inspection=label,
-                    ata=raw_ata,
-                    description=_clean(row.get("Description", "")),
-                    due_date=due_date,
-                    remaining_days=remaining_days,
-                    remaining_hours=_to_float(row.get("Remaining Hours")),
-                )
-            )
+    # ATA codes repeat heavily across rows, so rules run once per distinct
+    # code and the labels are mapped back to rows through the factorize codes
+    # (-1 for blanks picks the trailing empty tuple).
+    codes, uniques = pd.factorize(_column(insp_df, "ATA and Code"))
+    labels = pd.Series([_ata_labels(ata) for ata in uniques] + [()], dtype=object)
+    # explode() keeps source row order, labels in rule order within a row.
+    matched = insp_df.assign(_label=labels.to_numpy()[codes]).explode("_label")
+    matched = matched[matched["_label"].notna()]
+
+    due = _parse_dates(_column(matched, "Next Due Date"))
+    # A parseable due date wins over the export's own Remaining Days.
+    days_to_due = (due.dt.normalize() - pd.Timestamp(today)).dt.days.astype(float)
+    remaining_days = days_to_due.where(
+        due.notna(), _column(matched, "Remaining Days")
+    )
+
+    inspections = [
+        InspectionItem(
+            tail=tail,
+            inspection=label,
+            ata=raw_ata,
+            description=description,
+            due_date=due_date,
+            remaining_days=days,
+            remaining_hours=hours,
+        )
+        for tail, label, raw_ata, description, due_date, days, hours in zip(
+            _clean_col(_column(matched, "Registration Number")),
+            matched["_label"],
+            _clean_col(_column(matched, "ATA and Code")),
+            _clean_col(_column(matched, "Description")),
+            _iso_dates(due),
+            _none_for_nan(remaining_days),
+            _none_for_nan(_to_float_col(_column(matched, "Remaining Hours"))),
+        )
+    ]
     return inspections
 
 
@@ -279,26 +445,32 @@ def _collect_components(df: pd.DataFrame) -> dict[str, list[dict[str, Any]]]:
     if not required_columns.issubset(df.columns):
         return {}
 
-    subset = df[
-        df["Requirement Type"].astype(str).str.upper().isin(["RETIRE", "OVERHAUL"])
-    ].copy()
-    subset["Remaining Hours"] = pd.to_numeric(subset["Remaining Hours"], errors="coerce")
-    subset = subset[
-        subset["Remaining Hours"].notna()
-        & (subset["Remaining Hours"] <= COMPONENT_WINDOW_HOURS)
-    ]
-    grouped: dict[str, list[dict[str, Any]]] = {}
-    for _, row in subset.sort_values("Remaining Hours").iterrows():
-        tail = _clean(row.get("Registration Number", "")) or "UNKNOWN"
-        grouped.setdefault(tail, []).append(
-            {
-                "description":      _clean(row.get("Description", "")),
-                "ata":              _clean(row.get("ATA and Code", "")),
-                "requirement_type": _clean(row.get("Requirement Type", "")).upper(),
-                "remaining_hours":  float(row["Remaining Hours"]),
-            }
-        )
-    return grouped
+    # Strict: text such as "12 hrs" or "150/300" is not a usable hours figure.
+    hours = pd.to_numeric(df["Remaining Hours"], errors="coerce").astype(float)
+    in_window = _upper_isin(df["Requirement Type"], {"RETIRE", "OVERHAUL"}) & (
+        hours <= COMPONENT_WINDOW_HOURS
+    )
+    hours = hours[in_window].sort_values()
+    # Only the emitted columns are materialised, already in hours order;
+    # reindex() fills columns the export lacks with NaN, which _clean_col maps to "".
+    rows = df.reindex(
+        index=hours.index,
+        columns=["Registration Number", "Description", "ATA and Code", "Requirement Type"],
+    )
+    records = pd.DataFrame(
+        {
+            "description":      _clean_col(rows["Description"]),
+            "ata":              _clean_col(rows["ATA and Code"]),
+            "requirement_type": _clean_col(rows["Requirement Type"]).str.upper(),
+            "remaining_hours":  hours,
+        }
+    )
+    tails = _clean_col(rows["Registration Number"]).replace("", "UNKNOWN")
+    # sort=False keeps tails in order of their most urgent component.
+    return {
+        tail: group.to_dict("records")
+        for tail, group in records.groupby(tails, sort=False)
+    }
 
 
 def build() -> None:
@@ -306,6 +478,11 @@ def build() -> None:
     if missing:
         raise FileNotFoundError(f"Missing CSV files: {missing}")
 
+    # One clock read per build: the timestamp and every remaining-days figure
+    # agree even if the run straddles midnight.
+    generated = datetime.now(timezone.utc)
+    today = generated.astimezone().date()
+
     print(f"Reading daily CSV:  {DAILY_CSV}")
     daily_df = _read_csv(DAILY_CSV)
     print(f"Reading weekly CSV: {WEEKLY_CSV}")
@@ -314,14 +491,16 @@ def build() -> None:
     history = _load_history()
     # Seed with weekly baseline first so long-range history exists immediately,
     # then overlay the latest daily feed for freshest values.
-    history = _update_history(history, weekly_df)
-    history = _update_history(history, daily_df)
-    _save_history(history)
+    history, changed = _update_history(history, weekly_df, daily_df)
+    print(f"History readings changed:  {changed}")
+    # Runs without new readings leave the tracked file (and its mtime) alone.
+    if changed or not HISTORY_JSON.exists():
+        _save_history(history)
 
     utilization = _utilization(history)
 
-    weekly_inspections = _collect_inspections(weekly_df)
-    daily_inspections  = _collect_inspections(daily_df)
+    weekly_inspections = _collect_inspections(weekly_df, today)
+    daily_inspections  = _collect_inspections(daily_df, today)
     print(f"Weekly inspections parsed: {len(weekly_inspections)}")
     print(f"Daily inspections parsed:  {len(daily_inspections)}")
     inspections = _merge_inspections(weekly_inspections, daily_inspections)
@@ -329,36 +508,34 @@ def build() -> None:
 
     components = _collect_components(daily_df)
 
-    aircraft: dict[str, dict[str, Any]] = {}
+    # Aircraft that only appear in utilization history still render, even if
+    # they currently have no tracked inspections.
+    tails = {item.tail for item in inspections} | utilization.keys()
+    aircraft: dict[str, dict[str, Any]] = {
+        tail: {
+            "tail": tail,
+            "inspections": [],
+            "utilization": utilization[tail] if tail in utilization else _empty_utilization(),
+        }
+        for tail in sorted(tails)
+    }
     for item in inspections:
-        aircraft.setdefault(item.tail, {"tail": item.tail, "inspections": []})
-        aircraft[item.tail]["inspections"].append(item.__dict__)
-
-    # Ensure aircraft that only appear in utilization history still render,
-    # even if they currently have no tracked inspections.
-    for tail in utilization:
-        aircraft.setdefault(tail, {"tail": tail, "inspections": []})
-
-    for tail, ac in aircraft.items():
-        ac["utilization"] = utilization.get(
-            tail,
-            {"avg_daily_hours": None, "avg_weekly_hours": None, "daily_points": [], "hour_deltas": []},
-        )
+        aircraft[item.tail]["inspections"].append(asdict(item))
 
     output = {
         "meta": {
-            "generated_utc":  datetime.now(timezone.utc).isoformat(),
+            "generated_utc":  generated.isoformat(timespec="seconds").replace("+00:00", "Z"),
             "daily_csv":      str(DAILY_CSV),
             "weekly_csv":     str(WEEKLY_CSV),
             "aircraft_count": len(aircraft),
         },
-        "aircraft":               sorted(aircraft.values(), key=lambda x: x["tail"]),
+        "aircraft":               list(aircraft.values()),
         "components_by_aircraft": components,
         "inspection_names":       sorted({item.inspection for item in inspections}),
     }
 
     OUTPUT_JSON.parent.mkdir(parents=True, exist_ok=True)
-    OUTPUT_JSON.write_text(json.dumps(output, indent=2), encoding="utf-8")
+    _write_json(OUTPUT_JSON, output)
     print(f"Built {OUTPUT_JSON} — {len(output['aircraft'])} aircraft, "
           f"{len(output['inspection_names'])} inspection types")
     print(f"Inspection types found: {output['inspection_names']}")